@@ -1,13 +1,19 @@
 # Copyright (c) 2022 Oracle and/or its affiliates.
 # All rights reserved. The Universal Permissive License (UPL), Version 1.0 as shown at http://oss.oracle.com/licenses/upl
 
-import requests
+import aiohttp
+import asyncio
+import functools
 import sys
 import pandas as pd
-import json
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import orjson
 from oci.config import from_file
 from oci.signer import Signer
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import urlsplit
 
 
 def main():
@@ -19,14 +25,144 @@ def main():
         home_region=str(sys.argv[2])
         from_date=str(sys.argv[3])
         to_date=str(sys.argv[4])
-        call_endpoint(tenancy_ocid, home_region, from_date, to_date)
-    
+        dump_json='--dump-json' in sys.argv[5:]
+        asyncio.run(call_endpoint(tenancy_ocid, home_region, from_date, to_date, dump_json))
 
-    
 
-def call_endpoint(tenancy_ocid, home_region, from_date, to_date):
+def month_ranges(from_date, to_date):
+    # Split [from_date, to_date] into calendar-month sub-ranges so the
+    # requests can be issued concurrently instead of one big blocking call
+    start=datetime.strptime(from_date, '%Y-%m-%d').date()
+    end=datetime.strptime(to_date, '%Y-%m-%d').date()
+    ranges=[]
+    current=start
+    while current < end:
+        if current.month == 12:
+            boundary=date(current.year+1, 1, 1)
+        else:
+            boundary=date(current.year, current.month+1, 1)
+        if boundary > end:
+            boundary=end
+        ranges.append((current.isoformat(), boundary.isoformat()))
+        current=boundary
+    if not ranges:
+        ranges.append((from_date, to_date))
+    return ranges
+
+
+CSV_CHUNK_ROWS = 50_000
+
+
+def shrink_dtypes(df):
+    # usage rows repeat the same few strings thousands of times; category
+    # codes shrink those columns and speed up the CSV write
+    for c in ['service', 'compartmentPath', 'skuPartNumber', 'skuName', 'tagKey', 'tagValue', 'currency',
+              'platform', 'region', 'shape', 'unit']:
+        if c in df:
+            df[c] = df[c].astype('category')
+    for c in ['computedAmount', 'computedQuantity', 'unitPrice', 'listRate', 'weight']:
+        if c in df:
+            df[c] = pd.to_numeric(df[c], downcast='float')
+    if 'tags' in df:
+        # nested list-of-dict column; Arrow's CSV writer only takes flat types
+        df['tags'] = df['tags'].astype(str)
+    return df
+
+
+def write_csv(items):
+    # Convert and write in bounded slices so peak memory stays at one
+    # chunk's worth instead of the whole multi-month item list
+    first = shrink_dtypes(pd.DataFrame(items[:CSV_CHUNK_ROWS]))
+    table = pa.Table.from_pandas(first, preserve_index=False)
+    write_options = pacsv.WriteOptions(batch_size=8192)
+    # binary sink with a 1 MiB buffer: fewer write() syscalls, no newline translation
+    with open('output.csv', 'wb', buffering=1 << 20) as f:
+        with pacsv.CSVWriter(f, table.schema, write_options=write_options) as writer:
+            writer.write_table(table)
+            for i in range(CSV_CHUNK_ROWS, len(items), CSV_CHUNK_ROWS):
+                chunk = shrink_dtypes(pd.DataFrame(items[i:i+CSV_CHUNK_ROWS]))
+                writer.write_table(pa.Table.from_pandas(chunk, preserve_index=False, schema=table.schema))
+
+
+class SigningSurrogate:
+    # minimal stand-in for requests.PreparedRequest: the Signer only reads
+    # method, url, path_url, headers and body
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.path_url = urlsplit(url).path
+        self.headers = {}
+        self.body = None
+
+
+def dump_out_json(raw_parts, json_string):
+    with open('out.json','wb', buffering=1 << 20) as f:
+        if len(raw_parts) == 1:
+            # single sub-range: write the response bytes as received, no re-encode
+            f.write(raw_parts[0])
+            return
+        # encode key by key, and the items list element by element, so the
+        # merged document is never held as one payload-sized buffer
+        f.write(b'{')
+        first=True
+        for key, value in json_string.items():
+            if not first:
+                f.write(b',')
+            first=False
+            f.write(orjson.dumps(key))
+            f.write(b':')
+            if key == 'items':
+                f.write(b'[')
+                for i, item in enumerate(value):
+                    if i:
+                        f.write(b',')
+                    f.write(orjson.dumps(item))
+                f.write(b']')
+            else:
+                f.write(orjson.dumps(value))
+        f.write(b'}')
+
+
+def signed_headers(auth, surrogate, body_bytes):
+    # The OCI Signer is a requests auth adapter; feed it the reusable
+    # surrogate with fresh headers and hand the result to aiohttp.
+    # The RSA signature itself cannot be hoisted because the body digest
+    # differs per sub-range.
+    surrogate.headers = {'content-type': 'application/json',
+                         'content-length': str(len(body_bytes))}
+    surrogate.body = body_bytes
+    auth(surrogate)
+    return dict(surrogate.headers)
+
+
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+async def fetch(session, auth, surrogate, body_bytes):
+    for attempt in range(MAX_RETRIES + 1):
+        # re-sign per attempt so the signed date stays fresh across backoffs
+        headers = signed_headers(auth, surrogate, body_bytes)
+        # cost responses are highly repetitive JSON; gzip cuts the transfer ~10x
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        async with session.post(surrogate.url, data=body_bytes, headers=headers) as response:
+            if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                try:
+                    delay = float(response.headers.get('Retry-After'))
+                except (TypeError, ValueError):
+                    delay = 0.5 * 2 ** attempt
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            return await response.read()
+
+
+@functools.lru_cache(maxsize=1)
+def get_signer():
+    # reading ~/.oci/config and building the Signer hits disk and parses
+    # the private key; do it once per process, not per call
     config = from_file()
-    auth = Signer(
+    return Signer(
     tenancy=config['tenancy'],
     user=config['user'],
     fingerprint=config['fingerprint'],
@@ -34,17 +170,20 @@ def call_endpoint(tenancy_ocid, home_region, from_date, to_date):
     pass_phrase=config['pass_phrase']
     )
 
+
+async def call_endpoint(tenancy_ocid, home_region, from_date, to_date, dump_json=False):
+    auth = get_signer()
+
     tz_adjustment='T00:00:00Z'
-    from_date=from_date+tz_adjustment
-    to_date=to_date+tz_adjustment
     endpoint = 'https://usageapi.'+home_region+'.oci.oraclecloud.com/20200107/usage'
-    body = {
+    # serialize the body once; only the two date fields differ per sub-range
+    template = orjson.dumps({
     'tenantId': tenancy_ocid,
-    'timeUsageStarted': from_date,
-    'timeUsageEnded': to_date,
-    'granularity': 'DAILY',  
+    'timeUsageStarted': '__FROM__',
+    'timeUsageEnded': '__TO__',
+    'granularity': 'DAILY',
     "queryType": "COST",
-    "groupBy": [   
+    "groupBy": [
         "tagKey",
         "tagValue",
         "service",
@@ -52,21 +191,32 @@ def call_endpoint(tenancy_ocid, home_region, from_date, to_date):
     ],
     "compartmentDepth": 4,
 
-    }
+    })
+    bodies=[]
+    for start, end in month_ranges(from_date, to_date):
+        bodies.append(template.replace(b'__FROM__', (start+tz_adjustment).encode())
+                              .replace(b'__TO__', (end+tz_adjustment).encode()))
+
+    surrogate = SigningSurrogate('POST', endpoint)
+    connector = aiohttp.TCPConnector(limit=16)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        raw_parts = await asyncio.gather(*[fetch(session, auth, surrogate, body) for body in bodies])
 
-    response = requests.post(endpoint, json=body, auth=auth)
-    response.raise_for_status()
-    json_string=response.json()
-    with open('out.json','w') as f:
-        json.dump(json_string, f, ensure_ascii=False, indent=4)    
-    f.close()
-        
-    df = pd.DataFrame.from_dict(json_string, orient='index')
-    df = df.transpose()           
-    df.to_csv('output.csv', encoding='utf-8', index=False) 
-    
+    parts=[orjson.loads(raw) for raw in raw_parts]
+    json_string=parts[0]
+    for extra in parts[1:]:
+        json_string['items'].extend(extra.get('items', []))
+
+    if dump_json:
+        # overlap the out.json write with the CSV conversion; the json dump
+        # releases the GIL in the write() call and orjson encode
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            dump = executor.submit(dump_out_json, raw_parts, json_string)
+            write_csv(json_string['items'])
+            dump.result()
+    else:
+        write_csv(json_string['items'])
 
 
-    
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
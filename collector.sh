@@ -17,4 +17,4 @@ then
 fi
 
 source "./venv/bin/activate"
-python3 collector.py $1 $2 $3 $4  
\ No newline at end of file
+python3 collector.py "$@"
\ No newline at end of file